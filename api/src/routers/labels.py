@@ -1,6 +1,8 @@
 from typing import Annotated
 from datetime import datetime
+import shutil
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 
 from shared.supabase import verify_token, use_client
@@ -71,7 +73,7 @@ def create_new_labels(dataset_id: int, data: LabelPayloadData, token: Annotated[
 	# upload the dataset
 	with use_client(token) as client:
 		try:
-			send_data = {k: v for k, v in label.model_dump().items() if k != 'id' and v is not None}
+			send_data = label.model_dump(exclude={'id'}, exclude_none=True, mode='json')
 			response = client.table(settings.labels_table).insert(send_data).execute()
 		except Exception as e:
 			msg = f'An error occurred while trying to upload the label: {str(e)}'
@@ -133,8 +135,9 @@ async def upload_user_labels(
 	)
 
 	try:
+		# stream the spooled upload to disk with a bounded buffer, instead of reading it into memory
 		with target_path.open('wb') as buffer:
-			buffer.write(await file.read())
+			await run_in_threadpool(shutil.copyfileobj, file.file, buffer, 1024 * 1024)
 	except Exception as e:
 		logger.exception(f'Error saving label object to {target_path}: {str(e)}', extra={'token': token})
 		raise HTTPException(status_code=400, detail=f'Error saving label object to {target_path}: {str(e)}')
@@ -154,7 +157,7 @@ async def upload_user_labels(
 
 	try:
 		with use_client(token) as client:
-			send_data = {k: v for k, v in label_object.model_dump().items() if v is not None}
+			send_data = label_object.model_dump(exclude_none=True, mode='json')
 			response = client.table(settings.label_objects_table).insert(send_data).execute()
 			logger.info(
 				f'Inserted label object into database: {response.data[0]}',
@@ -1,5 +1,5 @@
 from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 
 from shared.supabase import verify_token, use_client
@@ -16,11 +16,22 @@ router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
 
 
+def update_admin_levels_in_background(dataset_id: int, token: str):
+	"""Fill in the admin levels after the response was sent. Errors cannot reach the client anymore,
+	and update_metadata_admin_level already logged them, so they are swallowed here.
+	"""
+	try:
+		update_metadata_admin_level(dataset_id, token)
+	except HTTPException:
+		pass
+
+
 @router.put('/datasets/{dataset_id}/metadata')
 def upsert_metadata(
 	dataset_id: int,
 	payload: MetadataPayloadData,
 	token: Annotated[str, Depends(oauth2_scheme)],
+	background_tasks: BackgroundTasks,
 ):
 	"""
 	Insert or Update the metadata of a Dataset.
@@ -48,7 +59,8 @@ def upsert_metadata(
 		with use_client(token) as client:
 			response = client.table(settings.metadata_table).select('*').eq('dataset_id', dataset_id).execute()
 			if len(response.data) > 0:
-				metadata = Metadata(**response.data[0]).model_dump()
+				# the row is validated once, together with the payload below
+				metadata = response.data[0]
 			else:
 				logger.info(
 					f'No existing Metadata found for Dataset {dataset_id}. Creating a new one.',
@@ -62,8 +74,8 @@ def upsert_metadata(
 
 	# update the given metadata if any with the payload
 	try:
-		metadata.update(**{k: v for k, v in payload.model_dump().items() if v is not None})
-		metadata = Metadata(**metadata)
+		metadata.update(**payload.model_dump(exclude_none=True))
+		metadata = Metadata.model_validate(metadata)
 	except Exception as e:
 		msg = f'An error occurred while trying to create the updated metadata: {str(e)}'
 
@@ -73,7 +85,7 @@ def upsert_metadata(
 	try:
 		# upsert the given metadata entry with the merged data
 		with use_client(token) as client:
-			send_data = {k: v for k, v in metadata.model_dump().items() if v is not None}
+			send_data = metadata.model_dump(exclude_none=True, mode='json')
 			response = client.table(settings.metadata_table).upsert(send_data).execute()
 	except Exception as e:
 		err_msg = f'An error occurred while trying to upsert the metadata of Dataset <ID={dataset_id}>: {e}'
@@ -93,18 +105,11 @@ def upsert_metadata(
 		extra={'token': token, 'dataset_id': dataset_id, 'user_id': user.id},
 	)
 
-	# update the metadata
-	logger.info(f'Updating admin level information for dataset {dataset_id}', extra={'token': token})
-	try:
-		update_metadata_admin_level(dataset_id, token)
-	except Exception as e:
-		logger.exception(
-			f'Error updating admin level information for dataset {dataset_id}: {str(e)}', extra={'token': token}
-		)
-		raise HTTPException(
-			status_code=400, detail=f'Error updating admin level information for dataset {dataset_id}: {str(e)}'
-		)
 	metadata = Metadata(**response.data[0])
 	# monitoring.metadata_counter.inc()
 
+	# the GADM lookup is slow, so the admin levels are filled in after the response was sent
+	if metadata.admin_level_1 is None:
+		background_tasks.add_task(update_admin_levels_in_background, dataset_id, token)
+
 	return metadata
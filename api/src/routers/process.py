@@ -58,7 +58,7 @@ def create_processing_task(
 	# Add the task to the queue
 	try:
 		with use_client(token) as client:
-			send_data = {k: v for k, v in payload.model_dump().items() if v is not None and k != 'id'}
+			send_data = payload.model_dump(exclude={'id'}, exclude_none=True, mode='json')
 			response = client.table(settings.queue_table).insert(send_data).execute()
 			task = TaskPayload(**response.data[0])
 
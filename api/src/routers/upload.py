@@ -1,23 +1,88 @@
-from typing import Annotated
+from typing import Annotated, Optional, Tuple
+from collections import OrderedDict
 from pathlib import Path
-import hashlib
+from concurrent.futures import ThreadPoolExecutor, Future
+import asyncio
+import shutil
 import uuid
 import time
-import aiofiles
+import os
+import anyio
 from fastapi import UploadFile, Depends, HTTPException, Form, APIRouter
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 
-from shared.models import Metadata, MetadataPayloadData
-from shared.supabase import use_client, verify_token
+from shared.supabase import verify_token
 from shared.settings import settings
 from shared.logger import logger
 
-from ..upload.upload import create_initial_dataset_entry, get_transformed_bounds, get_file_identifier
+from ..upload.upload import (
+	create_initial_dataset_entry,
+	get_transformed_bounds,
+	get_header_bounds,
+	get_file_identifier,
+	write_chunk,
+)
+from ..upload.geotiff_header import is_tiff
 
 router = APIRouter()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
 
+# one pool for hashing and reading the bounds of finished uploads, reused across all uploads
+# and kept apart from the shared threadpool that serves the sync endpoints
+executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix='upload')
+
+# chunk writes run in their own share of threads, so that many parallel uploads cannot take all
+# threads of the shared threadpool away from the other endpoints
+_chunk_write_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+def get_chunk_write_limiter() -> anyio.CapacityLimiter:
+	"""Get the limiter of the chunk writes. Older anyio versions can only create it inside the event loop"""
+	global _chunk_write_limiter
+
+	if _chunk_write_limiter is None:
+		_chunk_write_limiter = anyio.CapacityLimiter(os.cpu_count() or 1)
+	return _chunk_write_limiter
+
+
+# bounds read from the header after the first chunk, by upload_id. Abandoned uploads never reach
+# their last chunk, so their entries are dropped after HEADER_BOUNDS_TTL seconds or when the cache is full
+HEADER_BOUNDS_CACHE_SIZE = 1024
+HEADER_BOUNDS_TTL = 24 * 60 * 60
+
+header_bounds: 'OrderedDict[str, Tuple[Future, float]]' = OrderedDict()
+
+
+def remember_header_bounds(upload_id: str, future: Future):
+	"""Keep the bounds read from the header until the last chunk arrives, and evict those of abandoned uploads"""
+	now = time.monotonic()
+	header_bounds[upload_id] = (future, now + HEADER_BOUNDS_TTL)
+	header_bounds.move_to_end(upload_id)
+
+	# the oldest entries come first, so stop at the first one that is still valid
+	while header_bounds:
+		oldest, expires_at = next(iter(header_bounds.values()))
+		if expires_at > now and len(header_bounds) <= HEADER_BOUNDS_CACHE_SIZE:
+			break
+		header_bounds.popitem(last=False)
+		oldest.cancel()
+
+
+async def resolve_bounds(upload_id: str, target_path: Path):
+	"""Use the bounds read from the header after the first chunk, or read them from the finished file"""
+	future, _ = header_bounds.pop(upload_id, (None, None))
+	if future is not None:
+		try:
+			return await asyncio.wrap_future(future)
+		except Exception:
+			# the georeferencing was not in the first chunk, e.g. if the IFD is written at the end
+			pass
+
+	loop = asyncio.get_running_loop()
+	return await loop.run_in_executor(executor, get_transformed_bounds, target_path)
+
 
 @router.post('/datasets/chunk')
 async def upload_geotiff_chunk(
@@ -28,51 +93,75 @@ async def upload_geotiff_chunk(
 	copy_time: Annotated[int, Form()],
 	upload_id: Annotated[str, Form()],
 	token: Annotated[str, Depends(oauth2_scheme)],
+	chunk_offset: Annotated[Optional[int], Form()] = None,
 ):
 	"""Handle chunked upload of a GeoTIFF file with incremental hash computation"""
-	user = verify_token(token)
+	# all blocking work, including the supabase requests, runs in the threadpool to keep the event loop free
+	user = await run_in_threadpool(verify_token, token)
 	if not user:
 		raise HTTPException(status_code=401, detail='Invalid token')
 
 	chunk_index = int(chunk_index)
 	chunks_total = int(chunks_total)
 
+	# reject anything that is not a TIFF, before a single byte is written to the archive
+	if chunk_index == 0:
+		await file.seek(0)
+		head = await file.read(4)
+		if not is_tiff(head):
+			raise HTTPException(status_code=415, detail='The uploaded file is not a GeoTIFF')
+
 	upload_file_name = f'{upload_id}.tif'
 	upload_target_path = settings.archive_path / upload_file_name
 
-	# Write chunk and update hash
-	content = await file.read()
-	mode = 'wb' if chunk_index == 0 else 'ab'
-	async with aiofiles.open(upload_target_path, mode) as buffer:
-		await buffer.write(content)
+	# refuse uploads that would fill up the archive, before any chunk is written.
+	# the first chunk is a full chunk, so the whole upload needs at most chunks_total times its size
+	if chunk_index == 0 and file.size is not None:
+		disk_usage = await run_in_threadpool(shutil.disk_usage, settings.archive_path)
+		if disk_usage.free < file.size * chunks_total:
+			logger.error(
+				f'Not enough disk space for upload {filename}: {disk_usage.free} bytes free',
+				extra={'token': token, 'user_id': user.id},
+			)
+			raise HTTPException(status_code=507, detail='Not enough disk space to store the upload')
+
+	# Copy the chunk from the spooled upload file into the target, without loading it into memory.
+	# Clients sending the byte offset of the chunk can safely retry it, older clients just append.
+	# The last chunk ends at the end of the file, so its end is the size of the upload
+	chunk_end = await anyio.to_thread.run_sync(
+		write_chunk, file.file, upload_target_path, chunk_index > 0, chunk_offset, limiter=get_chunk_write_limiter()
+	)
 
-	# Process final chunk
+	# the GeoTIFF header is usually in the first chunk, so read the bounds while the other chunks arrive
+	if chunk_index == 0 and chunks_total > 1:
+		remember_header_bounds(upload_id, executor.submit(get_header_bounds, upload_target_path))
+
+	# Process final chunk. The upload is finalized as soon as the last chunk arrives, so clients have to send
+	# it after all other chunks were received. Offsets only make retries of a chunk safe, not reordering
 	if chunk_index == chunks_total - 1:
 		try:
 			# rename file
 			uid = str(uuid.uuid4())
 			file_name = f'{uid}_{Path(filename).stem}.tif'
 			target_path = settings.archive_path / file_name
-			upload_target_path.rename(target_path)
-
-			# Get final hash
-			final_sha256 = get_file_identifier(target_path)
-			# logger.info(
-			# 	f'Hashing took {hash_time:.2f}s for {target_path.stat().st_size / 1024 / 1024 / 1024:.2f} GB',
-			# 	extra={'token': token},
-			# )
+			await run_in_threadpool(upload_target_path.rename, target_path)
 
-			# Get bounds
-			bbox = get_transformed_bounds(target_path)
+			# Get final hash and bounds concurrently, both read the head of the freshly written file
+			loop = asyncio.get_running_loop()
+			final_sha256, bbox = await asyncio.gather(
+				loop.run_in_executor(executor, get_file_identifier, target_path, chunk_end),
+				resolve_bounds(upload_id, target_path),
+			)
 
 			# Update dataset entry
-			dataset = create_initial_dataset_entry(
+			dataset = await run_in_threadpool(
+				create_initial_dataset_entry,
 				filename=file_name,
 				file_alias=filename,
 				user_id=user.id,
 				copy_time=copy_time,
 				token=token,
-				file_size=target_path.stat().st_size,
+				file_size=chunk_end,
 				bbox=bbox,
 				sha256=final_sha256,
 			)
@@ -82,119 +171,8 @@ async def upload_geotiff_chunk(
 		except Exception as e:
 			logger.exception(f'Error processing final chunk: {e}', extra={'token': token})
 			raise HTTPException(status_code=500, detail=str(e))
+		finally:
+			# the bounds are not needed anymore, also if the upload failed before they were used
+			header_bounds.pop(upload_id, None)
 
 	return {'message': f'Chunk {chunk_index} of {chunks_total} received'}
-
-
-# Main routes for the logic
-# @router.post('/datasets')
-# async def upload_geotiff(file: UploadFile, token: Annotated[str, Depends(oauth2_scheme)]):
-# 	"""
-# 	Create a new Dataset by uploading a GeoTIFF file.
-
-# 	Further metadata is not yet necessary. The response will contain a Dataset.id
-# 	that is needed for subsequent calls to the API. Once, the GeoTIFF is uploaded,
-# 	the backend will start pre-processing the file.
-# 	It can only be used in the front-end once preprocessing finished AND all mandatory
-# 	metadata is set.
-
-# 	To send the file use the `multipart/form-data` content type. The file has to be sent as the
-# 	value of a field named `file`. For example, using HTML forms like this:
-
-# 	```html
-# 	<form action="/upload" method="post" enctype="multipart/form-data">
-# 	    <input type="file" name="file">
-# 	    <input type="submit">
-# 	</form>
-# 	```
-
-# 	Or using the `requests` library in Python like this:
-
-# 	```python
-# 	import requests
-# 	url = "http://localhost:8000/upload"
-# 	files = {"file": open("example.txt", "rb")}
-# 	response = requests.post(url, files=files)
-# 	print(response.json())
-# 	```
-
-# 	"""
-# 	# first thing we do is verify the token
-# 	user = verify_token(token)
-# 	if not user:
-# 		return HTTPException(status_code=401, detail='Invalid token')
-
-# 	# we create a uuid for this dataset
-# 	uid = str(uuid.uuid4())
-
-# 	# new file name
-# 	file_name = f'{uid}_{Path(file.filename).stem}.tif'
-
-# 	# use the settings path to figure out a new location for this file
-# 	target_path = settings.archive_path / file_name
-
-# 	# start a timer
-# 	t1 = time.time()
-
-# 	# Stream the file in chunks instead of loading it all at once
-# 	sha256_hash = hashlib.sha256()
-# 	chunk_size = 4 * 1024 * 1024  # 4MB chunks for better performance with large files
-
-# 	try:
-# 		with target_path.open('wb') as buffer:
-# 			while chunk := await file.read(chunk_size):
-# 				buffer.write(chunk)
-# 				sha256_hash.update(chunk)
-
-# 		sha256 = sha256_hash.hexdigest()
-# 	except Exception as e:
-# 		logger.exception(f'Error saving file: {str(e)}', extra={'token': token})
-# 		raise HTTPException(status_code=400, detail=f'Error saving file: {str(e)}')
-
-# 	# try to open with rasterio
-# 	with rasterio.open(str(target_path), 'r') as src:
-# 		bounds = src.bounds
-# 		transformed_bounds = rasterio.warp.transform_bounds(src.crs, 'EPSG:4326', *bounds)
-
-# 	# stop the timer
-# 	t2 = time.time()
-
-# 	# fill the metadata
-# 	# dataset = Dataset(
-# 	data = dict(
-# 		file_name=target_path.name,
-# 		file_alias=file.filename,
-# 		file_size=target_path.stat().st_size,
-# 		copy_time=t2 - t1,
-# 		sha256=sha256,
-# 		bbox=transformed_bounds,
-# 		status=StatusEnum.pending,
-# 		user_id=user.id,
-# 	)
-# 	# print(data)
-# 	dataset = Dataset(**data)
-
-# 	# upload the dataset
-# 	with use_client(token) as client:
-# 		try:
-# 			send_data = {k: v for k, v in dataset.model_dump().items() if k != 'id' and v is not None}
-# 			response = client.table(settings.datasets_table).insert(send_data).execute()
-# 		except Exception as e:
-# 			logger.exception(
-# 				f'An error occurred while trying to upload the dataset: {str(e)}',
-# 				extra={'token': token, 'user_id': user.id},
-# 			)
-# 			raise HTTPException(
-# 				status_code=400,
-# 				detail=f'An error occurred while trying to upload the dataset: {str(e)}',
-# 			)
-
-# 	# update the dataset with the id
-# 	dataset = Dataset(**response.data[0])
-
-# 	logger.info(
-# 		f'Created new dataset <ID={dataset.id}> with file {dataset.file_alias}. ({format_size(dataset.file_size)}). Took {dataset.copy_time:.2f}s.',
-# 		extra={'token': token, 'user_id': user.id, 'dataset_id': dataset.id},
-# 	)
-
-# 	return dataset
@@ -15,6 +15,12 @@ app = FastAPI(
 monitoring.logfire.instrument_fastapi(app)
 
 
+@app.on_event('shutdown')
+def shutdown_upload_executor():
+	# wait for running upload finalizations before the worker exits
+	upload.executor.shutdown(wait=True)
+
+
 # add CORS middleware
 app.add_middleware(
 	CORSMiddleware,
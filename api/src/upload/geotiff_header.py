@@ -0,0 +1,165 @@
+"""Read the georeferencing of a GeoTIFF straight from its first IFD, without opening it in GDAL.
+
+Only north-up rasters georeferenced by a tiepoint and a pixel scale, with an EPSG code
+in the GeoKeys, are supported. Everything else raises a ValueError, so that the caller
+can fall back to rasterio.
+"""
+
+from typing import BinaryIO, Dict, Tuple
+from pathlib import Path
+import struct
+
+# magic bytes of little and big endian TIFF and BigTIFF files
+TIFF_SIGNATURES = (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+
+# TIFF tags
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+MODEL_TRANSFORMATION = 34264
+GEO_KEY_DIRECTORY = 34735
+
+# GeoKeys
+GT_MODEL_TYPE = 1024
+GT_RASTER_TYPE = 1025
+GEOGRAPHIC_TYPE = 2048
+PROJECTED_CS_TYPE = 3072
+
+MODEL_TYPE_PROJECTED = 1
+MODEL_TYPE_GEOGRAPHIC = 2
+RASTER_PIXEL_IS_AREA = 1
+USER_DEFINED = 32767
+
+# struct format of the TIFF field types that can hold the tags above
+_FIELD_TYPES = {1: 'B', 3: 'H', 4: 'I', 8: 'h', 9: 'i', 11: 'f', 12: 'd', 16: 'Q', 17: 'q'}
+
+_TAGS = (IMAGE_WIDTH, IMAGE_LENGTH, MODEL_PIXEL_SCALE, MODEL_TIEPOINT, MODEL_TRANSFORMATION, GEO_KEY_DIRECTORY)
+
+
+def is_tiff(head: bytes) -> bool:
+	"""Check if the first bytes of a file are the magic bytes of a TIFF or BigTIFF"""
+	return head[:4] in TIFF_SIGNATURES
+
+
+def _unpack(f: BinaryIO, fmt: str) -> tuple:
+	size = struct.calcsize(fmt)
+	data = f.read(size)
+	if len(data) < size:
+		raise ValueError('Unexpected end of the TIFF header')
+	return struct.unpack(fmt, data)
+
+
+def _read_first_ifd(f: BinaryIO) -> Dict[int, tuple]:
+	"""Read the values of the georeferencing tags from the first IFD of a TIFF or BigTIFF"""
+	byte_order = f.read(2)
+	if byte_order == b'II':
+		bo = '<'
+	elif byte_order == b'MM':
+		bo = '>'
+	else:
+		raise ValueError('Not a TIFF file')
+
+	(version,) = _unpack(f, bo + 'H')
+	if version == 42:
+		(ifd_offset,) = _unpack(f, bo + 'I')
+		count_fmt, entry_fmt, inline_size = 'H', 'HHI', 4
+	elif version == 43:
+		_, _, ifd_offset = _unpack(f, bo + 'HHQ')
+		count_fmt, entry_fmt, inline_size = 'Q', 'HHQ', 8
+	else:
+		raise ValueError('Not a TIFF file')
+
+	f.seek(ifd_offset)
+	(n_entries,) = _unpack(f, bo + count_fmt)
+	entry_size = struct.calcsize(bo + entry_fmt) + inline_size
+	entries = f.read(n_entries * entry_size)
+	if len(entries) < n_entries * entry_size:
+		raise ValueError('Unexpected end of the TIFF header')
+
+	tags = {}
+	for i in range(n_entries):
+		entry = entries[i * entry_size : (i + 1) * entry_size]
+		tag, field_type, count = struct.unpack_from(bo + entry_fmt, entry)
+		if tag not in _TAGS or field_type not in _FIELD_TYPES:
+			continue
+
+		value_fmt = f'{bo}{count}{_FIELD_TYPES[field_type]}'
+		value_size = struct.calcsize(value_fmt)
+		if value_size <= inline_size:
+			value = entry[-inline_size:][:value_size]
+		else:
+			(offset,) = struct.unpack_from(bo + ('I' if inline_size == 4 else 'Q'), entry, entry_size - inline_size)
+			f.seek(offset)
+			value = f.read(value_size)
+			if len(value) < value_size:
+				raise ValueError('Unexpected end of the TIFF header')
+		tags[tag] = struct.unpack(value_fmt, value)
+
+	return tags
+
+
+def _epsg_from_geokeys(geokeys: tuple) -> Tuple[str, int]:
+	"""Get the EPSG code and the raster type from the GeoKeyDirectory"""
+	if len(geokeys) < 4 or len(geokeys) < 4 + geokeys[3] * 4:
+		raise ValueError('Invalid GeoKeyDirectory')
+
+	n_keys = geokeys[3]
+	keys = {}
+	for i in range(n_keys):
+		key_id, location, count, value = geokeys[4 + i * 4 : 8 + i * 4]
+		# only keys stored directly in the directory are of interest here
+		if location == 0 and count == 1:
+			keys[key_id] = value
+
+	# the CRS key has to match the model type, e.g. a projected model only names its geographic base CRS otherwise
+	model_type = keys.get(GT_MODEL_TYPE)
+	if model_type == MODEL_TYPE_PROJECTED:
+		code = keys.get(PROJECTED_CS_TYPE)
+	elif model_type == MODEL_TYPE_GEOGRAPHIC:
+		code = keys.get(GEOGRAPHIC_TYPE)
+	else:
+		raise ValueError(f'Unsupported GeoTIFF model type {model_type}')
+	if code is None or code == USER_DEFINED:
+		raise ValueError('GeoTIFF has no EPSG code')
+
+	return f'EPSG:{code}', keys.get(GT_RASTER_TYPE, RASTER_PIXEL_IS_AREA)
+
+
+def read_geotiff_header(file_path: Path) -> Tuple[Tuple[float, float, float, float], str]:
+	"""Read the bounds and the CRS of a GeoTIFF from its header.
+
+	Args:
+	    file_path (Path): Path to the GeoTIFF, which may still be incomplete
+
+	Returns:
+	    Tuple[Tuple[float, float, float, float], str]: The (left, bottom, right, top) bounds in the
+	        CRS of the file, and the CRS as an EPSG string
+
+	Raises:
+	    ValueError: If the header is not readable or the georeferencing is not supported
+	"""
+	with open(file_path, 'rb') as f:
+		try:
+			tags = _read_first_ifd(f)
+		except (struct.error, OSError) as e:
+			raise ValueError(f'Could not read the TIFF header of {file_path}: {e}') from e
+
+	if MODEL_TRANSFORMATION in tags:
+		raise ValueError('Rotated or sheared GeoTIFFs are not supported')
+	required = (IMAGE_WIDTH, IMAGE_LENGTH, MODEL_PIXEL_SCALE, MODEL_TIEPOINT, GEO_KEY_DIRECTORY)
+	if not all(tag in tags for tag in required):
+		raise ValueError('GeoTIFF header has no georeferencing')
+
+	crs, raster_type = _epsg_from_geokeys(tags[GEO_KEY_DIRECTORY])
+	if raster_type != RASTER_PIXEL_IS_AREA:
+		# GDAL shifts PixelIsPoint rasters depending on its configuration, so leave those to GDAL
+		raise ValueError('Only PixelIsArea GeoTIFFs are supported')
+
+	width, height = tags[IMAGE_WIDTH][0], tags[IMAGE_LENGTH][0]
+	scale_x, scale_y = tags[MODEL_PIXEL_SCALE][:2]
+	i, j, _, x, y, _ = tags[MODEL_TIEPOINT][:6]
+
+	left = x - i * scale_x
+	top = y + j * scale_y
+	return (left, top - height * scale_y, left + width * scale_x, top), crs
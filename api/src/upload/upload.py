@@ -1,20 +1,37 @@
+from typing import BinaryIO, Optional
+from functools import lru_cache
 from pathlib import Path
+import threading
 import rasterio
 import hashlib
 import shutil
-import time
+import errno
+import mmap
+import io
+import os
 
+from pyproj import Transformer
+from pyproj.exceptions import ProjError
 from rasterio.env import Env
-from rasterio.warp import transform_bounds
 
 from fastapi import HTTPException
 
 from shared.models import Dataset, StatusEnum
-from shared.supabase import use_client, login
+from shared.supabase import use_client
 from shared.settings import settings
 from shared.logger import logger
 
-# from .update_metadata_admin_level import update_metadata_admin_level
+from .geotiff_header import read_geotiff_header
+
+# buffer size for the fallback copy of uploaded chunks
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# GDAL options for reading the bounds of an upload. The archive directory holds every upload,
+# so GDAL must not list it while looking for sidecar files that uploads never have
+_BOUNDS_ENV_OPTIONS = {'GTIFF_SRS_SOURCE': 'EPSG', 'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR'}
+
+# thresholds for the human readable file sizes, largest first
+_SIZE_UNITS = ((1 << 30, 'GB'), (1 << 20, 'MB'), (1 << 10, 'KB'))
 
 
 def format_size(size: int) -> str:
@@ -26,42 +43,182 @@ def format_size(size: int) -> str:
 	Returns:
 	    str: A proper human readable size string in bytes, KB, MB or GB
 	"""
-	if size < 1024:
-		return f'{size} bytes'
-	elif size < 1024**2:
-		return f'{size / 1024:.2f} KB'
-	elif size < 1024**3:
-		return f'{size / 1024**2:.2f} MB'
-	else:
-		return f'{size / 1024**3:.2f} GB'
+	for threshold, unit in _SIZE_UNITS:
+		if size >= threshold:
+			return f'{size / threshold:.2f} {unit}'
+	return f'{size} bytes'
+
+
+def _copy_fd(in_fd: int, out_fd: int, size: int) -> int:
+	"""Copy the first size bytes of in_fd to the current position of out_fd inside the kernel.
+
+	``os.copy_file_range`` is preferred, as it lets the filesystem clone or offload the copy,
+	e.g. reflinks on XFS/Btrfs or server side copies on NFS. If the file descriptors do not
+	support it, e.g. across filesystems, it falls back to ``os.sendfile``.
+
+	Returns:
+	    int: The number of bytes copied
+	"""
+	copy_file_range = getattr(os, 'copy_file_range', None)
+	copied = 0
+	while copied < size:
+		if copy_file_range is not None:
+			try:
+				sent = copy_file_range(in_fd, out_fd, size - copied, copied)
+			except OSError as e:
+				if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+					raise
+				copy_file_range = None
+				continue
+		else:
+			sent = os.sendfile(out_fd, in_fd, copied, size - copied)
+		if sent == 0:
+			break
+		copied += sent
+	return copied
+
+
+def write_chunk(src: BinaryIO, target_path: Path, append: bool = False, offset: Optional[int] = None) -> int:
+	"""Copy an uploaded chunk into the target file without reading it into Python.
+
+	The chunk is copied in-kernel using ``os.copy_file_range`` or ``os.sendfile``. If the chunk
+	is still held in memory, or the platform does not support either, it falls back to a
+	buffered ``shutil.copyfileobj``.
+
+	Args:
+	    src (BinaryIO): The uploaded chunk, i.e. the spooled file of the FastAPI UploadFile
+	    target_path (Path): The file the chunk is written into
+	    append (bool, optional): Append to the target instead of truncating it. Defaults to False.
+	    offset (Optional[int], optional): Write the chunk at this byte offset of the target instead,
+	        so a re-sent chunk overwrites itself rather than being appended twice. Defaults to None.
+
+	Returns:
+	    int: The position in the target file right after the chunk
+	"""
+	# sendfile and copy_file_range do not support O_APPEND, so we seek to the end of the file instead
+	flags = os.O_WRONLY | os.O_CREAT | (0 if append or offset is not None else os.O_TRUNC)
+	out_fd = os.open(target_path, flags, 0o644)
+	try:
+		# never cut off data of other chunks that already landed behind this one
+		file_size = os.fstat(out_fd).st_size
+		if offset is None:
+			start = os.lseek(out_fd, 0, os.SEEK_END)
+		else:
+			start = os.lseek(out_fd, offset, os.SEEK_SET)
+		src.seek(0)
+
+		# chunks below the spool size of starlette never hit the disk
+		if getattr(src, '_rolled', True):
+			try:
+				in_fd = src.fileno()
+				size = os.fstat(in_fd).st_size
+				if hasattr(os, 'posix_fadvise'):
+					os.posix_fadvise(in_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+				_copy_fd(in_fd, out_fd, size)
+			except (io.UnsupportedOperation, OSError):
+				# drop anything the kernel copy might have written before failing
+				os.lseek(out_fd, start, os.SEEK_SET)
+				os.ftruncate(out_fd, max(start, file_size))
+			else:
+				# the spooled chunk is never read again, so it should not push other files out of the page cache
+				if hasattr(os, 'posix_fadvise'):
+					os.posix_fadvise(in_fd, 0, 0, os.POSIX_FADV_DONTNEED)
+				return os.lseek(out_fd, 0, os.SEEK_CUR)
+
+		with open(out_fd, 'wb', closefd=False) as dst:
+			shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+		return os.lseek(out_fd, 0, os.SEEK_CUR)
+	finally:
+		os.close(out_fd)
+
+
+@lru_cache(maxsize=128)
+def _get_transformer(crs: str, thread_id: int) -> Transformer:
+	"""Build a transformer to EPSG:4326 once per CRS (WKT or EPSG string), as this initializes a whole
+	PROJ pipeline. Transformers must not be shared between threads, thus they are cached per thread.
+	"""
+	return Transformer.from_crs(crs, 'EPSG:4326', always_xy=True)
+
+
+def _to_wgs84_bounds(src):
+	"""Transform the bounds of an opened dataset to EPSG:4326"""
+	transformer = _get_transformer(src.crs.to_wkt(), threading.get_ident())
+	return transformer.transform_bounds(*src.bounds)
+
+
+def _read_header_bounds(file_path: Path):
+	"""Transform the bounds read from the GeoTIFF header to EPSG:4326, raises ValueError or ProjError if unsupported"""
+	bounds, crs = read_geotiff_header(file_path)
+	return _get_transformer(crs, threading.get_ident()).transform_bounds(*bounds)
 
 
 def get_transformed_bounds(file_path: Path):
 	"""Get transformed bounds from GeoTIFF"""
-	with Env(GTIFF_SRS_SOURCE='EPSG'):
-		with rasterio.open(str(file_path), 'r') as src:
+	# most uploads can be georeferenced from the header alone, without opening them in GDAL
+	try:
+		return _read_header_bounds(file_path)
+	except (ValueError, ProjError):
+		# unsupported georeferencing, or an EPSG code unknown to PROJ
+		pass
+
+	with Env(**_BOUNDS_ENV_OPTIONS):
+		with rasterio.open(str(file_path), 'r', sharing=False) as src:
 			try:
-				return transform_bounds(src.crs, 'EPSG:4326', *src.bounds)
+				return _to_wgs84_bounds(src)
 			except Exception as e:
 				logger.error(f'No CRS found for {file_path}: {e}')
 				return None
 
 
-def get_file_identifier(file_path: Path, sample_size: int = 10 * 1024 * 1024) -> str:
-	"""Generate a quick file identifier by sampling start/end of file"""
-	file_size = file_path.stat().st_size
+def get_header_bounds(file_path: Path):
+	"""Get transformed bounds from a GeoTIFF that is still being uploaded.
+
+	This only succeeds if the georeferencing is fully contained in the part of the
+	file that is already written. Otherwise it raises, so that the caller can fall
+	back to get_transformed_bounds on the finished file.
+	"""
+	try:
+		return _read_header_bounds(file_path)
+	except (ValueError, ProjError):
+		# unsupported georeferencing, or an EPSG code unknown to PROJ
+		pass
+
+	with Env(**_BOUNDS_ENV_OPTIONS):
+		with rasterio.open(str(file_path), 'r', sharing=False) as src:
+			if src.crs is None or src.transform.is_identity:
+				raise ValueError(f'Georeferencing of {file_path} is not within the written part of the file')
+			return _to_wgs84_bounds(src)
+
+
+def get_file_identifier(file_path: Path, file_size: Optional[int] = None, sample_size: int = 10 * 1024 * 1024) -> str:
+	"""Generate a quick file identifier by sampling start/end of file.
+	The file size is read from the file, if the caller does not know it already.
+	"""
+	if file_size is None:
+		file_size = file_path.stat().st_size
 	hasher = hashlib.sha256()
 
-	with open(file_path, 'rb') as f:
-		# Hash file size
-		hasher.update(str(file_size).encode())
+	# Hash file size
+	hasher.update(str(file_size).encode())
 
-		# Hash first 10MB
-		hasher.update(f.read(sample_size))
+	# an empty file cannot be mapped, and has no samples to hash
+	if file_size == 0:
+		return hasher.hexdigest()
 
-		# Hash last 10MB
-		f.seek(-min(sample_size, file_size), 2)
-		hasher.update(f.read(sample_size))
+	# map the file, so that the samples are hashed from the page cache without copying them
+	with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		sample = min(sample_size, file_size)
+		view = memoryview(mm)
+		try:
+			# Hash first 10MB
+			hasher.update(view[:sample])
+
+			# Hash last 10MB
+			hasher.update(view[file_size - sample :])
+		finally:
+			# the view has to be released before the map can be closed
+			view.release()
 
 	return hasher.hexdigest()
 
@@ -70,113 +227,25 @@ def create_initial_dataset_entry(
 	filename: str, file_alias: str, user_id: str, copy_time: int, file_size: int, sha256: str, bbox, token: str
 ) -> Dataset:
 	"""Create an initial dataset entry with available information."""
-	data = dict(
+	# build the payload directly, the Dataset is only validated from the response
+	send_data = dict(
 		file_name=filename,
 		file_alias=file_alias,
-		status=StatusEnum.uploaded,
+		status=StatusEnum.uploaded.value,
 		user_id=user_id,
 		copy_time=copy_time,
 		file_size=file_size,
 		sha256=sha256,
-		bbox=bbox,
 	)
-	dataset = Dataset(**data)
-	print(dataset)
+	if bbox is not None:
+		# same PostGIS format as Dataset.bbox_to_postgis
+		send_data['bbox'] = 'BOX({} {},{} {})'.format(*bbox)
 
 	with use_client(token) as client:
 		try:
-			send_data = {k: v for k, v in dataset.model_dump().items() if k != 'id' and v is not None}
 			response = client.table(settings.datasets_table).insert(send_data).execute()
 		except Exception as e:
 			logger.exception(f'Error creating initial dataset entry: {str(e)}', extra={'token': token})
 			raise HTTPException(status_code=400, detail=f'Error creating initial dataset entry: {str(e)}')
 
 	return Dataset(**response.data[0])
-
-
-# def update_dataset_entry(dataset_id: int, file_size: int, sha256: str, bbox):
-# 	"""Update the existing dataset entry with processed information."""
-
-# 	token = login(settings.processing_username, settings.processing_password)
-
-# 	data = dict(
-# 		file_name=None,
-# 		file_alias=None,
-# 		copy_time=None,
-# 		user_id=None,
-# 		file_size=file_size,
-# 		sha256=sha256,
-# 		bbox=bbox,
-# 		status=StatusEnum.uploaded,
-# 	)
-# 	dataset_update = Dataset(**data)
-
-# 	with use_client(token) as client:
-# 		try:
-# 			client.table(settings.datasets_table).update(
-# 				dataset_update.model_dump(include={'file_size', 'sha256', 'bbox', 'status'})
-# 			).eq('id', dataset_id).execute()
-# 		except Exception as e:
-# 			logger.exception(f'Error updating dataset: {str(e)}', extra={'token': token})
-# 			raise HTTPException(status_code=400, detail=f'Error updating dataset: {str(e)}')
-
-
-# def assemble_chunks(upload_id: str, new_file_name: str, chunks_total: int, temp_dir: str, dataset: Dataset) -> Dataset:
-# 	"""Assemble chunks into final file"""
-# 	temp_dir = Path(temp_dir)
-# 	target_path = settings.archive_path / new_file_name
-
-# 	logger.info(f'Assembling chunks for {target_path}')
-
-# 	# Explicit conversion to ensure chunks_total is int
-# 	chunks_total = int(chunks_total)
-
-# 	# Assemble chunks
-# 	with open(target_path, 'wb') as outfile:
-# 		for i in range(chunks_total):
-# 			chunk_path = Path(temp_dir) / f'chunk_{i}'
-# 			with open(chunk_path, 'rb') as infile:
-# 				shutil.copyfileobj(infile, outfile)
-# 	logger.info(f'Chunks assembled')
-
-# 	# Cleanup chunk files, dont delet parent folder
-# 	shutil.rmtree(temp_dir)
-
-# 	# Proceed with hashing and bounds extraction
-# 	try:
-# 		# Get file identifier
-# 		start_hashing = time.time()
-# 		final_hash = get_file_identifier(target_path)
-# 		hash_time = time.time() - start_hashing
-
-# 		logger.info(
-# 			f'Hashing took {hash_time:.2f}s for {target_path.stat().st_size / (1024 ** 3):.2f} GB',
-# 			# extra={'token': token},
-# 		)
-
-# 		# Get bounds
-# 		start_bounds = time.time()
-# 		bbox = get_transformed_bounds(target_path)
-# 		bounds_time = time.time() - start_bounds
-
-# 		file_size = target_path.stat().st_size
-
-# 		logger.info(
-# 			f'Getting bounds took {bounds_time:.2f}s',
-# 			# extra={'token': token},
-# 		)
-
-# 		# Update dataset entry
-# 		logger.info(f'Updating dataset entry for {dataset.id}')
-# 		dataset = update_dataset_entry(
-# 			dataset_id=dataset.id,
-# 			file_size=file_size,
-# 			sha256=final_hash,
-# 			bbox=bbox,
-# 		)
-
-# 		return dataset
-
-# 	except Exception as e:
-# 		logger.exception(f'Error assembling chunks: {e}', extra={'token': token})
-# 		raise HTTPException(status_code=500, detail=str(e))
@@ -1,4 +1,5 @@
 from typing import Tuple, List, Optional
+from functools import lru_cache
 import geopandas as gpd
 from pathlib import Path
 from shapely.geometry import Point
@@ -15,10 +16,42 @@ if not GADM_PATH.exists():
 	raise FileNotFoundError(f'GADM data file not found at {GADM_PATH}')
 
 
+# decimal places the point is rounded to for the lookup cache, 3 places are roughly 100 meters
+ADMIN_TAGS_PRECISION = 3
+
+
+@lru_cache(maxsize=4096)
+def _lookup_admin_tags(lon: float, lat: float) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+	"""
+	Look up the administrative names of a point in the GADM data. Failed lookups raise,
+	so that only actual results end up in the cache.
+	"""
+	# Create Point object (lon, lat)
+	point_geom = Point(lon, lat)
+
+	# Read only necessary columns and use spatial filter
+	columns = ['NAME_0', 'NAME_2', 'NAME_4', 'geometry']
+	gdf = gpd.read_file(
+		GADM_PATH,
+		mask=point_geom.buffer(0.1),  # Small buffer to optimize spatial query
+		columns=columns,
+	)
+
+	if not gdf.empty:
+		# Find the polygon containing our point
+		mask = gdf.geometry.contains(point_geom)
+		if mask.any():
+			row = gdf[mask].iloc[0]
+			return row['NAME_0'], row['NAME_2'], row['NAME_4']
+
+	return None, None, None
+
+
 def get_admin_tags(point: Tuple[float, float]) -> List[Optional[str]]:
 	"""
 	Returns administrative names for levels 0 (country), 1 (state/province),
 	and 2 (municipality/district).
+	The lookups are cached by the point rounded to ADMIN_TAGS_PRECISION.
 
 	Args:
 	    point: Tuple of (longitude, latitude)
@@ -27,25 +60,8 @@ def get_admin_tags(point: Tuple[float, float]) -> List[Optional[str]]:
 	    List of [country_name, state_name, district_name]
 	"""
 	try:
-		# Create Point object (lon, lat)
-		point_geom = Point(point[0], point[1])
-
-		# Read only necessary columns and use spatial filter
-		columns = ['NAME_0', 'NAME_2', 'NAME_4', 'geometry']
-		gdf = gpd.read_file(
-			GADM_PATH,
-			mask=point_geom.buffer(0.1),  # Small buffer to optimize spatial query
-			columns=columns,
-		)
-
-		if not gdf.empty:
-			# Find the polygon containing our point
-			mask = gdf.geometry.contains(point_geom)
-			if mask.any():
-				row = gdf[mask].iloc[0]
-				return [row['NAME_0'], row['NAME_2'], row['NAME_4']]
-
-		return [None, None, None]
+		lon, lat = round(point[0], ADMIN_TAGS_PRECISION), round(point[1], ADMIN_TAGS_PRECISION)
+		return list(_lookup_admin_tags(lon, lat))
 
 	except Exception as e:
 		logger.error(f'Error getting GADM admin tags: {str(e)}')
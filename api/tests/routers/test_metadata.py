@@ -1,7 +1,10 @@
 import pytest
+from unittest.mock import patch
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
 from api.src.server import app
+from api.src.routers.metadata import update_admin_levels_in_background
 from shared.supabase import use_client
 from shared.settings import settings
 from shared.models import MetadataPayloadData, PlatformEnum, DatasetAccessEnum
@@ -90,3 +93,12 @@ def test_upsert_metadata_invalid_dataset(auth_token):
 		headers={'Authorization': f'Bearer {auth_token}'},
 	)
 	assert response.status_code == 400
+
+
+def test_update_admin_levels_in_background_swallows_errors():
+	"""Test that a failing admin level update after the response does not raise"""
+	error = HTTPException(status_code=400, detail='No centroid')
+	with patch('api.src.routers.metadata.update_metadata_admin_level', side_effect=error) as update:
+		update_admin_levels_in_background(1, 'token')
+
+	update.assert_called_once_with(1, 'token')
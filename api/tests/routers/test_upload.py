@@ -1,9 +1,11 @@
 import pytest
+from concurrent.futures import Future
 from pathlib import Path
 import tempfile
 import shutil
 from fastapi.testclient import TestClient
 from api.src.server import app
+from api.src.routers import upload as upload_router
 from shared.supabase import login, use_client
 from shared.settings import settings
 
@@ -130,3 +132,41 @@ def test_upload_without_auth():
 		},
 	)
 	assert response.status_code == 401
+
+
+def test_upload_non_tiff(auth_token):
+	"""Test that a first chunk without TIFF magic bytes is rejected"""
+	response = client.post(
+		'/datasets/chunk',
+		files={'file': ('test.tif', b'test data', 'application/octet-stream')},
+		data={
+			'chunk_index': '0',
+			'chunks_total': '1',
+			'filename': 'test.tif',
+			'copy_time': '0',
+			'upload_id': 'test',
+		},
+		headers={'Authorization': f'Bearer {auth_token}'},
+	)
+	assert response.status_code == 415
+
+
+def test_header_bounds_eviction(monkeypatch):
+	"""Test that the header bounds of abandoned uploads are evicted by age and by the size of the cache"""
+	monkeypatch.setattr(upload_router, 'header_bounds', upload_router.OrderedDict())
+	monkeypatch.setattr(upload_router, 'HEADER_BOUNDS_CACHE_SIZE', 2)
+
+	futures = [Future() for _ in range(3)]
+	for i, future in enumerate(futures):
+		upload_router.remember_header_bounds(f'upload-{i}', future)
+
+	# the oldest upload was dropped to make room
+	assert list(upload_router.header_bounds) == ['upload-1', 'upload-2']
+	assert futures[0].cancelled()
+
+	# a day later, the remaining uploads expired and only the new one is kept
+	now = upload_router.time.monotonic() + upload_router.HEADER_BOUNDS_TTL
+	monkeypatch.setattr(upload_router.time, 'monotonic', lambda: now)
+	upload_router.remember_header_bounds('upload-3', Future())
+	assert list(upload_router.header_bounds) == ['upload-3']
+	assert futures[1].cancelled() and futures[2].cancelled()
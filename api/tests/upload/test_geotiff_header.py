@@ -0,0 +1,110 @@
+import struct
+
+import pytest
+
+from api.src.upload.geotiff_header import (
+	GEO_KEY_DIRECTORY,
+	GEOGRAPHIC_TYPE,
+	GT_MODEL_TYPE,
+	GT_RASTER_TYPE,
+	IMAGE_LENGTH,
+	IMAGE_WIDTH,
+	MODEL_PIXEL_SCALE,
+	MODEL_TIEPOINT,
+	MODEL_TYPE_GEOGRAPHIC,
+	MODEL_TYPE_PROJECTED,
+	PROJECTED_CS_TYPE,
+	USER_DEFINED,
+	is_tiff,
+	read_geotiff_header,
+)
+
+# struct format of the TIFF field types used below: SHORT, LONG and DOUBLE
+FIELD_FORMATS = {3: 'H', 4: 'I', 12: 'd'}
+
+
+def write_geotiff(path, byte_order, bigtiff, cs_key, epsg, raster_type=1, model_type=None):
+	"""Write the header of a 100 x 50 pixel GeoTIFF with its top left corner at (1000, 2000),
+	georeferenced by a tiepoint and a pixel scale of 0.5 x 0.25. No image data is written.
+	The model type matches the CRS key, unless it is given.
+	"""
+	bo = '<' if byte_order == 'II' else '>'
+	if model_type is None:
+		model_type = MODEL_TYPE_PROJECTED if cs_key == PROJECTED_CS_TYPE else MODEL_TYPE_GEOGRAPHIC
+	geokeys = (1, 1, 0, 3, GT_MODEL_TYPE, 0, 1, model_type, GT_RASTER_TYPE, 0, 1, raster_type, cs_key, 0, 1, epsg)
+	entries = [
+		(IMAGE_WIDTH, 4, (100,)),
+		(IMAGE_LENGTH, 3, (50,)),
+		(MODEL_PIXEL_SCALE, 12, (0.5, 0.25, 0.0)),
+		(MODEL_TIEPOINT, 12, (0.0, 0.0, 0.0, 1000.0, 2000.0, 0.0)),
+		(GEO_KEY_DIRECTORY, 3, geokeys),
+	]
+
+	if bigtiff:
+		header = byte_order.encode() + struct.pack(bo + 'HHHQ', 43, 8, 0, 16)
+		count_fmt, offset_fmt = 'Q', 'Q'
+	else:
+		header = byte_order.encode() + struct.pack(bo + 'HI', 42, 8)
+		count_fmt, offset_fmt = 'H', 'I'
+	inline_size = struct.calcsize(offset_fmt)
+
+	# the values that do not fit into their entry are written right behind the IFD
+	entry_size = 4 + 2 * inline_size
+	data_offset = len(header) + struct.calcsize(count_fmt) + len(entries) * entry_size + inline_size
+	ifd = struct.pack(bo + count_fmt, len(entries))
+	data = b''
+	for tag, field_type, values in entries:
+		value = struct.pack(f'{bo}{len(values)}{FIELD_FORMATS[field_type]}', *values)
+		if len(value) <= inline_size:
+			field = value.ljust(inline_size, b'\x00')
+		else:
+			field = struct.pack(bo + offset_fmt, data_offset + len(data))
+			data += value
+		ifd += struct.pack(bo + 'HH' + offset_fmt, tag, field_type, len(values)) + field
+	ifd += struct.pack(bo + offset_fmt, 0)
+
+	assert len(header) + len(ifd) == data_offset
+	path.write_bytes(header + ifd + data)
+	return path
+
+
+@pytest.mark.parametrize('byte_order', ['II', 'MM'])
+@pytest.mark.parametrize('bigtiff', [False, True])
+@pytest.mark.parametrize('cs_key,epsg', [(PROJECTED_CS_TYPE, 32632), (GEOGRAPHIC_TYPE, 4326)])
+def test_read_geotiff_header(tmp_path, byte_order, bigtiff, cs_key, epsg):
+	"""Test the bounds and the CRS read from little and big endian TIFF and BigTIFF headers"""
+	path = write_geotiff(tmp_path / 'test.tif', byte_order, bigtiff, cs_key, epsg)
+	assert is_tiff(path.read_bytes()[:4])
+
+	bounds, crs = read_geotiff_header(path)
+
+	assert bounds == (1000.0, 1987.5, 1050.0, 2000.0)
+	assert crs == f'EPSG:{epsg}'
+
+
+def test_read_geotiff_header_truncated(tmp_path):
+	"""Test that an incomplete header raises a ValueError"""
+	header = write_geotiff(tmp_path / 'test.tif', 'II', False, PROJECTED_CS_TYPE, 32632).read_bytes()
+
+	truncated = tmp_path / 'truncated.tif'
+	for size in (6, 20, len(header) - 8):
+		truncated.write_bytes(header[:size])
+		with pytest.raises(ValueError):
+			read_geotiff_header(truncated)
+
+
+@pytest.mark.parametrize(
+	'cs_key,epsg,raster_type,model_type',
+	[
+		(PROJECTED_CS_TYPE, USER_DEFINED, 1, None),
+		(PROJECTED_CS_TYPE, 32632, 2, None),
+		(GEOGRAPHIC_TYPE, 4326, 1, MODEL_TYPE_PROJECTED),
+	],
+	ids=['user-defined-crs', 'pixel-is-point', 'projected-without-projected-cs'],
+)
+def test_read_geotiff_header_unsupported(tmp_path, cs_key, epsg, raster_type, model_type):
+	"""Test that georeferencing left to rasterio raises a ValueError"""
+	path = write_geotiff(tmp_path / 'test.tif', 'II', False, cs_key, epsg, raster_type, model_type)
+
+	with pytest.raises(ValueError):
+		read_geotiff_header(path)
@@ -0,0 +1,83 @@
+import os
+import tempfile
+
+import pytest
+
+from api.src.upload.upload import format_size, write_chunk
+
+
+@pytest.mark.parametrize(
+	'size,expected',
+	[
+		(0, '0 bytes'),
+		(1023, '1023 bytes'),
+		(1024, '1.00 KB'),
+		(1536, '1.50 KB'),
+		(1024**2, '1.00 MB'),
+		(5 * 1024**3, '5.00 GB'),
+	],
+)
+def test_format_size(size, expected):
+	"""Test the human readable file sizes at the unit boundaries"""
+	assert format_size(size) == expected
+
+
+def spooled_chunk(data: bytes, rolled: bool = True):
+	"""Build a chunk like the spooled file of an UploadFile, either rolled over to disk or still in memory"""
+	chunk = tempfile.SpooledTemporaryFile(max_size=1 if rolled else len(data) + 1)
+	chunk.write(data)
+	assert chunk._rolled == rolled
+	return chunk
+
+
+def test_write_chunk_append(tmp_path):
+	"""Test that the first chunk truncates the target and the following chunks are appended"""
+	target = tmp_path / 'upload.tif'
+	target.write_bytes(b'left over from an earlier upload')
+
+	assert write_chunk(spooled_chunk(b'first'), target) == 5
+	assert write_chunk(spooled_chunk(b'second'), target, append=True) == 11
+	assert target.read_bytes() == b'firstsecond'
+
+
+def test_write_chunk_offset(tmp_path):
+	"""Test that chunks are written at their offset, also if they do not arrive in order"""
+	target = tmp_path / 'upload.tif'
+
+	assert write_chunk(spooled_chunk(b'second'), target, offset=5) == 11
+	assert write_chunk(spooled_chunk(b'first'), target, offset=0) == 5
+	assert target.read_bytes() == b'firstsecond'
+
+
+def test_write_chunk_retried(tmp_path):
+	"""Test that a re-sent chunk overwrites itself instead of being appended twice"""
+	target = tmp_path / 'upload.tif'
+
+	write_chunk(spooled_chunk(b'first'), target, offset=0)
+	write_chunk(spooled_chunk(b'second'), target, offset=5)
+	assert write_chunk(spooled_chunk(b'second'), target, offset=5) == 11
+	assert target.read_bytes() == b'firstsecond'
+
+
+@pytest.mark.parametrize('offset', [None, 5])
+def test_write_chunk_in_memory(tmp_path, offset):
+	"""Test that chunks which were never spooled to disk are copied as well"""
+	target = tmp_path / 'upload.tif'
+
+	write_chunk(spooled_chunk(b'first', rolled=False), target, offset=0 if offset is not None else None)
+	assert write_chunk(spooled_chunk(b'second', rolled=False), target, append=True, offset=offset) == 11
+	assert target.read_bytes() == b'firstsecond'
+
+
+def test_write_chunk_failed_copy(tmp_path, monkeypatch):
+	"""Test that a partially failed kernel copy is cut off before the chunk is copied again"""
+	target = tmp_path / 'upload.tif'
+	write_chunk(spooled_chunk(b'first'), target)
+
+	def failing_copy(in_fd, out_fd, size):
+		os.write(out_fd, b'garbage that must not stay in the file')
+		raise OSError('copy failed')
+
+	monkeypatch.setattr('api.src.upload.upload._copy_fd', failing_copy)
+	assert write_chunk(spooled_chunk(b'second'), target, append=True) == 11
+	assert target.read_bytes() == b'firstsecond'
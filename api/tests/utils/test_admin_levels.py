@@ -1,6 +1,6 @@
 import pytest
 from pathlib import Path
-from api.src.utils.admin_levels import get_admin_tags, update_metadata_admin_level
+from api.src.utils.admin_levels import get_admin_tags, update_metadata_admin_level, _lookup_admin_tags
 from shared.models import Dataset
 from shared.settings import settings
 from shared.supabase import use_client, login
@@ -45,6 +45,16 @@ def test_get_admin_tags(point, expected):
 	assert result == expected
 
 
+def test_get_admin_tags_cached():
+	"""Test that points within the cache precision reuse the first lookup"""
+	first = get_admin_tags((13.40501, 52.52001))
+	hits = _lookup_admin_tags.cache_info().hits
+
+	second = get_admin_tags((13.40502, 52.52002))
+	assert second == first
+	assert _lookup_admin_tags.cache_info().hits == hits + 1
+
+
 def test_update_metadata_admin_level(test_dataset, auth_token):
 	"""Test updating metadata with admin levels using real database"""
 	# Test the function with real database
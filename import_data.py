@@ -48,6 +48,7 @@ def chunked_upload(file_path: Path, token: str, user_id: str, chunk_size: int =
 				'filename': file_path.name,
 				'copy_time': str(int(time.time() - start_time)),
 				'upload_id': upload_id,
+				'chunk_offset': str(chunk_index * chunk_size),
 			}
 
 			try:
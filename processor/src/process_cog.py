@@ -93,7 +93,7 @@ def process_cog(task: QueueTask, temp_dir: Path):
 			raise AuthenticationError('Token refresh failed', token=token, task_id=task.id)
 
 		with use_client(token) as client:
-			send_data = {k: v for k, v in cog.model_dump().items() if v is not None}
+			send_data = cog.model_dump(exclude_none=True, mode='json')
 			client.table(settings.cogs_table).upsert(send_data).execute()
 
 		# Update final status
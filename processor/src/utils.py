@@ -1,4 +1,6 @@
+from typing import Optional
 import os
+import threading
 import paramiko
 from pathlib import Path
 
@@ -7,14 +9,28 @@ from shared.settings import settings
 from shared.models import StatusEnum
 from shared.supabase import use_client
 
+# receive window of the sftp channels, large enough to keep long distance transfers of big files busy
+SFTP_WINDOW_SIZE = 2**27
+
+# the ssh connection to the storage server, kept open across pulls and pushes
+_ssh_client: Optional[paramiko.SSHClient] = None
+_ssh_lock = threading.Lock()
 
-def pull_file_from_storage_server(remote_file_path: str, local_file_path: str, token: str):
-	# Check if the file already exists locally
-	if os.path.exists(local_file_path):
-		logger.info(f'File already exists locally at: {local_file_path}')
-		return
 
-	with paramiko.SSHClient() as ssh:
+def _get_ssh_client(token: str) -> paramiko.SSHClient:
+	"""Get the open ssh connection to the storage server, or connect if there is none or it was dropped"""
+	global _ssh_client
+
+	with _ssh_lock:
+		transport = _ssh_client.get_transport() if _ssh_client is not None else None
+		if transport is not None and transport.is_active():
+			return _ssh_client
+
+		if _ssh_client is not None:
+			_ssh_client.close()
+			_ssh_client = None
+
+		ssh = paramiko.SSHClient()
 		ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 		pkey = paramiko.RSAKey.from_private_key_file(
 			settings.SSH_PRIVATE_KEY_PATH, password=settings.SSH_PRIVATE_KEY_PASSPHRASE
@@ -23,29 +39,62 @@ def pull_file_from_storage_server(remote_file_path: str, local_file_path: str, t
 			f'Connecting to storage server: {settings.STORAGE_SERVER_IP} as {settings.STORAGE_SERVER_USERNAME}',
 			extra={'token': token},
 		)
-
 		ssh.connect(
 			hostname=settings.STORAGE_SERVER_IP,
 			username=settings.STORAGE_SERVER_USERNAME,
 			pkey=pkey,
 			port=22,  # Add this line to specify the default SSH port
 		)
+		# keep the connection from being dropped while the processor is idle
+		ssh.get_transport().set_keepalive(30)
+
+		_ssh_client = ssh
+		return _ssh_client
+
+
+def _drop_ssh_client(ssh: paramiko.SSHClient):
+	"""Close a broken ssh connection, so that the next call connects again"""
+	global _ssh_client
+
+	with _ssh_lock:
+		if _ssh_client is ssh:
+			_ssh_client = None
+	ssh.close()
+
+
+def _open_sftp(token: str) -> paramiko.SFTPClient:
+	"""Open a new sftp channel on the shared ssh connection, channels are cheap compared to a connection"""
+	ssh = _get_ssh_client(token)
+	try:
+		return paramiko.SFTPClient.from_transport(ssh.get_transport(), window_size=SFTP_WINDOW_SIZE)
+	except (paramiko.SSHException, EOFError, OSError) as e:
+		# the connection can be dead although its transport still looks active, e.g. after a NAT timeout
+		logger.warning(f'Reconnecting to the storage server after a broken connection: {e}', extra={'token': token})
+		_drop_ssh_client(ssh)
+		return paramiko.SFTPClient.from_transport(_get_ssh_client(token).get_transport(), window_size=SFTP_WINDOW_SIZE)
+
+
+def pull_file_from_storage_server(remote_file_path: str, local_file_path: str, token: str):
+	# Check if the file already exists locally
+	if os.path.exists(local_file_path):
+		logger.info(f'File already exists locally at: {local_file_path}')
+		return
 
-		with ssh.open_sftp() as sftp:
-			logger.info(
-				f'Pulling file from storage server: {remote_file_path} to {local_file_path}', extra={'token': token}
-			)
+	with _open_sftp(token) as sftp:
+		logger.info(
+			f'Pulling file from storage server: {remote_file_path} to {local_file_path}', extra={'token': token}
+		)
 
-			# Create the directory for local_file_path if it doesn't exist
-			local_dir = Path(local_file_path).parent
-			local_dir.mkdir(parents=True, exist_ok=True)
-			sftp.get(remote_file_path, local_file_path)
+		# Create the directory for local_file_path if it doesn't exist
+		local_dir = Path(local_file_path).parent
+		local_dir.mkdir(parents=True, exist_ok=True)
+		sftp.get(remote_file_path, local_file_path)
 
-		# Check if the file exists after pulling
-		if os.path.exists(local_file_path):
-			logger.info(f'File successfully saved at: {local_file_path}', extra={'token': token})
-		else:
-			logger.error(f'Error: File not found at {local_file_path} after pulling', extra={'token': token})
+	# Check if the file exists after pulling
+	if os.path.exists(local_file_path):
+		logger.info(f'File successfully saved at: {local_file_path}', extra={'token': token})
+	else:
+		logger.error(f'Error: File not found at {local_file_path} after pulling', extra={'token': token})
 
 
 def push_file_to_storage_server(local_file_path: str, remote_file_path: str, token: str):
@@ -53,54 +102,35 @@ def push_file_to_storage_server(local_file_path: str, remote_file_path: str, tok
 		logger.info(f'Skipping push to storage server in dev mode: {local_file_path} -> {remote_file_path}')
 		return
 
-	with paramiko.SSHClient() as ssh:
-		ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-		logger.info(
-			f'Connecting to storage server: {settings.STORAGE_SERVER_IP} as {settings.STORAGE_SERVER_USERNAME}',
-			extra={'token': token},
-		)
-		pkey = paramiko.RSAKey.from_private_key_file(
-			settings.SSH_PRIVATE_KEY_PATH, password=settings.SSH_PRIVATE_KEY_PASSPHRASE
-		)
-		ssh.connect(
-			hostname=settings.STORAGE_SERVER_IP,
-			username=settings.STORAGE_SERVER_USERNAME,
-			pkey=pkey,
-			port=22,  # Add this line to specify the default SSH port
-		)
-		with ssh.open_sftp() as sftp:
-			logger.info(
-				f'Pushing file to storage server: {local_file_path} to {remote_file_path}', extra={'token': token}
-			)
+	with _open_sftp(token) as sftp:
+		logger.info(f'Pushing file to storage server: {local_file_path} to {remote_file_path}', extra={'token': token})
 
-			# Extract the remote directory path
-			remote_dir = os.path.dirname(remote_file_path)
+		# Extract the remote directory path
+		remote_dir = os.path.dirname(remote_file_path)
 
+		try:
+			sftp.stat(remote_file_path)
+			logger.warning(f'File {remote_file_path} already exists and will be overwritten', extra={'token': token})
+		except IOError:
+			logger.info(f'No existing file found at {remote_file_path}', extra={'token': token})
+
+		# Ensure the remote directory exists
+		try:
+			sftp.stat(remote_dir)
+		except IOError:
 			try:
-				sftp.stat(remote_file_path)
-				logger.warning(
-					f'File {remote_file_path} already exists and will be overwritten', extra={'token': token}
-				)
-			except IOError:
-				logger.info(f'No existing file found at {remote_file_path}', extra={'token': token})
-
-			# Ensure the remote directory exists
-			try:
-				sftp.stat(remote_dir)
-			except IOError:
-				try:
-					sftp.mkdir(remote_dir)
-					logger.info(f'Created directory {remote_dir}', extra={'token': token})
-				except IOError as e:
-					logger.warning(f'Error creating directory {remote_dir}: {e}', extra={'token': token})
-
-			# Push the file
-			try:
-				sftp.put(local_file_path, remote_file_path)
-				logger.info(f'File successfully pushed to: {remote_file_path}', extra={'token': token})
+				sftp.mkdir(remote_dir)
+				logger.info(f'Created directory {remote_dir}', extra={'token': token})
 			except IOError as e:
-				logger.error(f'Failed to push file to {remote_file_path}: {str(e)}', extra={'token': token})
-				raise
+				logger.warning(f'Error creating directory {remote_dir}: {e}', extra={'token': token})
+
+		# Push the file
+		try:
+			sftp.put(local_file_path, remote_file_path)
+			logger.info(f'File successfully pushed to: {remote_file_path}', extra={'token': token})
+		except IOError as e:
+			logger.error(f'Failed to push file to {remote_file_path}: {str(e)}', extra={'token': token})
+			raise
 
 
 def update_status(token: str, dataset_id: int, status: StatusEnum):
@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import base64
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from shared import supabase
+from shared.settings import Settings
+
+
+def auth_response(email='processor@deadtrees.earth', access_token='access', refresh_token='refresh', expires_in=3600):
+	"""Build a response shaped like the AuthResponse of supabase"""
+	return SimpleNamespace(
+		user=SimpleNamespace(email=email),
+		session=SimpleNamespace(
+			access_token=access_token,
+			refresh_token=refresh_token,
+			expires_at=int(time.time()) + expires_in,
+		),
+	)
+
+
+@pytest.fixture
+def session_cache(tmp_path, monkeypatch):
+	"""Persist the sessions into a temporary file, and start without a session in memory"""
+	path = tmp_path / 'sessions.json'
+	monkeypatch.setattr(Settings, 'session_cache_path', property(lambda self: path))
+	monkeypatch.setattr(supabase, 'cached_session', None)
+	return path
+
+
+class FakeAuth:
+	"""Records the sign ins and refreshes instead of sending them to supabase"""
+
+	def __init__(self):
+		self.sign_ins = []
+		self.refreshes = []
+
+	def sign_in_with_password(self, credentials):
+		self.sign_ins.append(credentials['email'])
+		return auth_response(credentials['email'], access_token='signed-in')
+
+	def refresh_session(self, refresh_token):
+		self.refreshes.append(refresh_token)
+		return auth_response(access_token='refreshed')
+
+
+@pytest.fixture
+def fake_auth(monkeypatch):
+	auth = FakeAuth()
+	monkeypatch.setattr(supabase, '_get_auth_client', lambda: SimpleNamespace(auth=auth))
+	return auth
+
+
+def test_session_cache_round_trip(session_cache):
+	"""Test that a stored session is private to the user and loaded again"""
+	supabase._store_session(auth_response(email='Processor@deadtrees.earth'))
+
+	assert session_cache.stat().st_mode & 0o777 == 0o600
+	session = supabase._load_session('processor@deadtrees.earth')
+	assert session.session.access_token == 'access'
+	assert session.session.refresh_token == 'refresh'
+	assert supabase._load_session('someone@else.earth') is None
+
+
+def test_session_cache_login_after_restart(session_cache, fake_auth):
+	"""Test that login uses the persisted session instead of signing in again"""
+	supabase._store_session(auth_response())
+
+	assert supabase.login('processor@deadtrees.earth', 'password') == 'access'
+	assert fake_auth.sign_ins == []
+
+
+def test_session_cache_expired(session_cache, fake_auth):
+	"""Test that an expired persisted session is refreshed, and the refreshed session is persisted"""
+	supabase._store_session(auth_response(expires_in=-60))
+
+	assert supabase.login('processor@deadtrees.earth', 'password') == 'refreshed'
+	assert fake_auth.refreshes == ['refresh']
+	assert fake_auth.sign_ins == []
+	assert supabase._load_session('processor@deadtrees.earth').session.access_token == 'refreshed'
+
+
+@pytest.mark.parametrize('mode', [0o640, 0o604, 0o660])
+def test_session_cache_rejects_shared_file(session_cache, mode):
+	"""Test that a cache readable or writable by other users is ignored"""
+	supabase._store_session(auth_response())
+	os.chmod(session_cache, mode)
+
+	assert supabase._load_session('processor@deadtrees.earth') is None
+
+
+def test_session_cache_rejects_foreign_owner(session_cache, monkeypatch):
+	"""Test that a cache owned by another user is ignored"""
+	supabase._store_session(auth_response())
+	uid = os.getuid()
+	monkeypatch.setattr(supabase.os, 'getuid', lambda: uid + 1)
+
+	assert supabase._load_session('processor@deadtrees.earth') is None
+
+
+def test_session_cache_rejects_symlink(session_cache, tmp_path):
+	"""Test that a symlink in place of the cache is not followed"""
+	target = tmp_path / 'elsewhere.json'
+	supabase._store_session(auth_response())
+	session_cache.rename(target)
+	session_cache.symlink_to(target)
+
+	assert supabase._load_session('processor@deadtrees.earth') is None
+
+
+def test_session_cache_does_not_write_planted_file(session_cache):
+	"""Test that an existing file at the temporary path is never written into"""
+	planted = session_cache.with_name(f'{session_cache.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+	planted.write_text('planted')
+
+	supabase._store_session(auth_response())
+
+	assert planted.read_text() == 'planted'
+	assert not session_cache.exists()
+
+
+def jwt(exp: float, sub: str = 'user') -> str:
+	"""Build an unsigned JWT, only its expiry is read locally"""
+	claims = base64.urlsafe_b64encode(json.dumps({'exp': exp, 'sub': sub}).encode()).decode().rstrip('=')
+	return f'header.{claims}.signature'
+
+
+class FakeClient:
+	"""Stands in for a supabase client"""
+
+	def __init__(self):
+		self.postgrest = SimpleNamespace(auth=lambda token: None)
+
+
+@pytest.fixture
+def created_clients(monkeypatch):
+	"""Record the supabase clients created, starting with an empty client cache"""
+	clients = []
+
+	def create_client(url, key, options=None):
+		clients.append(FakeClient())
+		return clients[-1]
+
+	monkeypatch.setattr(supabase, 'create_client', create_client)
+	monkeypatch.setattr(supabase, '_client_cache', OrderedDict())
+	return clients
+
+
+def test_client_cache_reuses_client(created_clients):
+	"""Test that requests with the same token share one client"""
+	token = jwt(time.time() + 3600)
+
+	with supabase.use_client(token) as first, supabase.use_client(token) as second:
+		assert first is second
+	with supabase.use_client(jwt(time.time() + 3600, sub='other')) as other:
+		assert other is not first
+	assert len(created_clients) == 2
+
+
+def test_client_cache_evicts_least_recently_used(created_clients, monkeypatch):
+	"""Test that the least recently used client is dropped when the cache is full"""
+	monkeypatch.setattr(supabase, 'CLIENT_CACHE_SIZE', 2)
+	tokens = [jwt(time.time() + 3600, sub=str(i)) for i in range(3)]
+
+	supabase._get_client(tokens[0])
+	supabase._get_client(tokens[1])
+	supabase._get_client(tokens[0])
+	supabase._get_client(tokens[2])
+
+	assert list(supabase._client_cache) == [tokens[0], tokens[2]]
+	assert supabase._get_client(tokens[0]) is created_clients[0]
+	assert len(created_clients) == 3
+
+
+def test_client_cache_drops_expiring_client(created_clients):
+	"""Test that a client is not reused shortly before its token expires"""
+	token = jwt(time.time() + supabase.CLIENT_EXPIRY_MARGIN / 2)
+
+	assert supabase._get_client(token) is not supabase._get_client(token)
+	assert len(created_clients) == 2
+
+
+class FakeUserAuth:
+	"""Answers get_user with the given user and counts the requests"""
+
+	def __init__(self, user):
+		self.user = user
+		self.requests = 0
+
+	def get_user(self, jwt):
+		self.requests += 1
+		if self.user is False:
+			# the response of a malformed token has no user
+			return object()
+		return SimpleNamespace(user=self.user)
+
+
+@pytest.fixture
+def verify(monkeypatch):
+	"""Verify tokens against a fake supabase, starting with an empty verify cache"""
+	monkeypatch.setattr(supabase, '_verify_cache', OrderedDict())
+
+	def with_user(user):
+		auth = FakeUserAuth(user)
+
+		@contextmanager
+		def use_client(access_token=None):
+			yield SimpleNamespace(auth=auth)
+
+		monkeypatch.setattr(supabase, 'use_client', use_client)
+		return auth
+
+	return with_user
+
+
+def test_verify_token_cached(verify):
+	"""Test that a verified token is not sent to supabase again"""
+	user = SimpleNamespace(id='user')
+	auth = verify(user)
+	token = jwt(time.time() + 3600)
+
+	assert supabase.verify_token(token) is user
+	assert supabase.verify_token(token) is user
+	assert auth.requests == 1
+
+
+def test_verify_token_cache_expires(verify, monkeypatch):
+	"""Test that a verified token is checked again after VERIFY_CACHE_TTL"""
+	monkeypatch.setattr(supabase, 'VERIFY_CACHE_TTL', -1)
+	auth = verify(SimpleNamespace(id='user'))
+	token = jwt(time.time() + 3600)
+
+	supabase.verify_token(token)
+	supabase.verify_token(token)
+	assert auth.requests == 2
+
+
+def test_verify_token_cache_ends_with_token(verify):
+	"""Test that a token is never trusted from the cache beyond its expiry"""
+	auth = verify(SimpleNamespace(id='user'))
+	token = jwt(time.time() - 1)
+
+	supabase.verify_token(token)
+	supabase.verify_token(token)
+	assert auth.requests == 2
+
+
+@pytest.mark.parametrize('user', [None, False])
+def test_verify_token_rejections_not_cached(verify, user):
+	"""Test that rejected tokens are checked again on the next request"""
+	auth = verify(user)
+	token = jwt(time.time() + 3600)
+
+	assert not supabase.verify_token(token)
+	assert not supabase.verify_token(token)
+	assert auth.requests == 2
+	assert len(supabase._verify_cache) == 0
+
+
+class FlakyQuery:
+	"""Query whose execute fails with a connection error for the given number of times"""
+
+	def __init__(self, failures):
+		self.failures = failures
+		self.calls = 0
+
+	def execute(self):
+		self.calls += 1
+		if self.calls <= self.failures:
+			raise httpx.ConnectError('connection reset')
+		return 'result'
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+	"""Record the backoff of the retries instead of waiting"""
+	sleeps = []
+	monkeypatch.setattr(supabase.time, 'sleep', sleeps.append)
+	return sleeps
+
+
+def test_execute_read_retries(sleeps):
+	"""Test that a read failing once with a connection error is retried"""
+	query = FlakyQuery(failures=1)
+
+	assert supabase._execute_read(query) == 'result'
+	assert query.calls == 2
+	assert sleeps == [supabase.READ_RETRY_BACKOFF]
+
+
+def test_execute_read_gives_up(sleeps):
+	"""Test that the connection error is raised once all retries failed"""
+	query = FlakyQuery(failures=supabase.READ_RETRIES + 1)
+
+	with pytest.raises(httpx.ConnectError):
+		supabase._execute_read(query)
+	assert query.calls == supabase.READ_RETRIES + 1
+	assert sleeps == [supabase.READ_RETRY_BACKOFF * 2**attempt for attempt in range(supabase.READ_RETRIES)]
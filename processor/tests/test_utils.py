@@ -0,0 +1,92 @@
+import pytest
+import paramiko
+
+from processor.src import utils
+
+
+class FakeTransport:
+	"""Transport that reports active, also if its connection is dead"""
+
+	def __init__(self):
+		self.broken = False
+
+	def is_active(self):
+		return True
+
+	def set_keepalive(self, interval):
+		pass
+
+
+class FakeSSHClient:
+	"""SSH client that records its connections instead of opening them"""
+
+	instances = []
+
+	def __init__(self):
+		self.transport = None
+		self.closed = False
+		FakeSSHClient.instances.append(self)
+
+	def set_missing_host_key_policy(self, policy):
+		pass
+
+	def connect(self, **kwargs):
+		self.transport = FakeTransport()
+
+	def get_transport(self):
+		return self.transport
+
+	def close(self):
+		self.closed = True
+
+
+def fake_from_transport(transport, window_size=None):
+	if transport.broken:
+		raise EOFError('connection reset')
+	return ('sftp', transport)
+
+
+@pytest.fixture
+def fake_ssh(monkeypatch):
+	"""Replace the ssh connection to the storage server by fakes"""
+	FakeSSHClient.instances = []
+	monkeypatch.setattr(utils, '_ssh_client', None)
+	monkeypatch.setattr(paramiko, 'SSHClient', FakeSSHClient)
+	monkeypatch.setattr(paramiko.RSAKey, 'from_private_key_file', lambda *args, **kwargs: None)
+	monkeypatch.setattr(paramiko.SFTPClient, 'from_transport', fake_from_transport)
+	return FakeSSHClient.instances
+
+
+def test_open_sftp_reuses_connection(fake_ssh):
+	"""Test that sftp channels share one ssh connection"""
+	utils._open_sftp('token')
+	utils._open_sftp('token')
+
+	assert len(fake_ssh) == 1
+
+
+def test_open_sftp_reconnects_stale_connection(fake_ssh):
+	"""Test that a dead connection, whose transport still reports active, is replaced once"""
+	utils._open_sftp('token')
+	stale = fake_ssh[0]
+	stale.transport.broken = True
+
+	sftp = utils._open_sftp('token')
+
+	assert len(fake_ssh) == 2
+	assert stale.closed
+	assert utils._ssh_client is fake_ssh[1]
+	assert sftp == ('sftp', fake_ssh[1].transport)
+
+
+def test_open_sftp_reconnects_only_once(fake_ssh, monkeypatch):
+	"""Test that the error is raised if the new connection fails as well"""
+
+	def always_broken(transport, window_size=None):
+		raise paramiko.SSHException('channel refused')
+
+	monkeypatch.setattr(paramiko.SFTPClient, 'from_transport', always_broken)
+
+	with pytest.raises(paramiko.SSHException):
+		utils._open_sftp('token')
+	assert len(fake_ssh) == 2
@@ -1,4 +1,5 @@
 from typing import Optional
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 from pathlib import Path
@@ -36,6 +37,14 @@ _dev_tables = {
 BASE = Path(__file__).parent.parent / 'data'
 
 
+@lru_cache(maxsize=None)
+def _ensure_dir(path: str) -> Path:
+	"""Create a directory on first use only, so that the path properties do not stat on every access"""
+	directory = Path(path)
+	directory.mkdir(parents=True, exist_ok=True)
+	return directory
+
+
 # load the settings from environment variables
 class Settings(BaseSettings):
 	# base directory for the storage app
@@ -80,6 +89,9 @@ class Settings(BaseSettings):
 
 	processing_dir: str = 'processing'
 
+	# sessions of login are kept in this file of the base directory across restarts
+	SESSION_CACHE_FILE: str = '.sessions.json'
+
 	_PROCESSING_PATH: Optional[Path] = None
 
 	# monitoring
@@ -94,43 +106,27 @@ class Settings(BaseSettings):
 
 	@property
 	def base_path(self) -> Path:
-		path = Path(self.BASE_DIR)
-		if not path.exists():
-			path.mkdir(parents=True, exist_ok=True)
+		return _ensure_dir(self.BASE_DIR)
 
-		return path
+	@property
+	def session_cache_path(self) -> Path:
+		return self.base_path / self.SESSION_CACHE_FILE
 
 	@property
 	def archive_path(self) -> Path:
-		path = self.base_path / self.ARCHIVE_DIR
-		if not path.exists():
-			path.mkdir(parents=True, exist_ok=True)
-
-		return path
+		return _ensure_dir(str(self.base_path / self.ARCHIVE_DIR))
 
 	@property
 	def cog_path(self) -> Path:
-		path = self.base_path / self.COG_DIR
-		if not path.exists():
-			path.mkdir(parents=True, exist_ok=True)
-
-		return path
+		return _ensure_dir(str(self.base_path / self.COG_DIR))
 
 	@property
 	def thumbnail_path(self) -> Path:
-		path = self.base_path / self.THUMBNAIL_DIR
-		if not path.exists():
-			path.mkdir(parents=True, exist_ok=True)
-
-		return path
+		return _ensure_dir(str(self.base_path / self.THUMBNAIL_DIR))
 
 	@property
 	def user_label_path(self) -> Path:
-		path = self.base_path / self.LABEL_OBJECTS_DIR
-		if not path.exists():
-			path.mkdir(parents=True, exist_ok=True)
-
-		return path
+		return _ensure_dir(str(self.base_path / self.LABEL_OBJECTS_DIR))
 
 	@property
 	def _tables(self) -> dict:
@@ -1,7 +1,18 @@
-from typing import Union, Literal, Optional, Generator
+from typing import Union, Literal, Optional, Generator, Tuple
+from collections import OrderedDict
 from contextlib import contextmanager
+from functools import lru_cache
+from types import SimpleNamespace
+from pathlib import Path
+import threading
+import hashlib
+import logging
+import base64
+import json
 import time
+import os
 
+import httpx
 from pydantic import BaseModel
 from supabase import create_client
 from supabase.client import Client, ClientOptions
@@ -9,13 +20,119 @@ from gotrue import User
 
 from .settings import settings
 
+# shared.logger imports this module, so the logger is looked up by name to avoid a circular import
+_logger = logging.getLogger('processor')
+
 # Global variable to store the cached session
 cached_session = None
 
+# one client for signing in and refreshing sessions, created on first login
+_auth_client: Optional[Client] = None
+_auth_client_lock = threading.Lock()
+_login_lock = threading.Lock()
+
+# supabase clients by access token, so that requests of the same session reuse the connection pool
+CLIENT_CACHE_SIZE = 128
+# clients are dropped this many seconds before their token expires
+CLIENT_EXPIRY_MARGIN = 30
+# lifetime of clients, whose token has no readable expiry
+CLIENT_DEFAULT_TTL = 60
+
+_client_cache: 'OrderedDict[Optional[str], Tuple[Client, float]]' = OrderedDict()
+_client_cache_lock = threading.Lock()
+
+# verified users by the sha256 of their token, so that the tokens themselves are not kept in memory
+VERIFY_CACHE_SIZE = 4096
+# seconds a verified token is trusted without asking supabase again
+VERIFY_CACHE_TTL = 300
+
+_verify_cache: 'OrderedDict[str, Tuple[User, float]]' = OrderedDict()
+_verify_cache_lock = threading.Lock()
+
+
+def _get_auth_client() -> Client:
+	"""Get the client used for signing in, which is shared to reuse its connections"""
+	global _auth_client
+
+	with _auth_client_lock:
+		if _auth_client is None:
+			_auth_client = create_client(
+				settings.SUPABASE_URL,
+				settings.SUPABASE_KEY,
+				options=ClientOptions(auto_refresh_token=False),
+			)
+		return _auth_client
+
+
+def _read_sessions(path: Path) -> dict:
+	"""Read the persisted sessions, if the file is owned by the current user and not accessible by others.
+	Anyone able to write the file could hand out their own tokens, so any other file is ignored.
+	"""
+	try:
+		fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+	except OSError:
+		return {}
+
+	with os.fdopen(fd) as f:
+		stat = os.fstat(fd)
+		if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+			_logger.warning(f'Ignoring the session cache {path}, it is not private to the current user')
+			return {}
+		try:
+			sessions = json.load(f)
+		except ValueError:
+			return {}
+
+	return sessions if isinstance(sessions, dict) else {}
+
+
+def _load_session(user: str) -> Optional[SimpleNamespace]:
+	"""Load the session of a user persisted by _store_session, shaped like the cached AuthResponse"""
+	try:
+		session = _read_sessions(settings.session_cache_path)[user.lower()]
+		return SimpleNamespace(
+			user=SimpleNamespace(email=user),
+			session=SimpleNamespace(
+				access_token=session['access_token'],
+				refresh_token=session['refresh_token'],
+				expires_at=session['expires_at'],
+			),
+		)
+	except (KeyError, TypeError):
+		return None
+
+
+def _store_session(auth_response) -> None:
+	"""Persist the cached session by user, so that it survives restarts of the process.
+	The file is only readable by the current user and replaced atomically.
+	"""
+	path = settings.session_cache_path
+	tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+	created = False
+	try:
+		sessions = _read_sessions(path)
+		sessions[auth_response.user.email.lower()] = dict(
+			access_token=auth_response.session.access_token,
+			refresh_token=auth_response.session.refresh_token,
+			expires_at=auth_response.session.expires_at,
+		)
+
+		# never write into a file that someone else put there
+		fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+		created = True
+		with os.fdopen(fd, 'w') as f:
+			json.dump(sessions, f)
+		os.replace(tmp_path, path)
+	except Exception as e:
+		# the cache is an optimization only, the session is still kept in memory
+		_logger.debug(f'Could not persist the session: {e}')
+		if created:
+			tmp_path.unlink(missing_ok=True)
+
 
 def login(user: str, password: str) -> str:
 	"""
-	Creates a supabase client instance, authorizes the user with login and password,
+	Authorizes the user with login and password using a shared supabase client,
 	and manages session caching and refreshing.
 
 	Args:
@@ -27,43 +144,61 @@ def login(user: str, password: str) -> str:
 	"""
 	global cached_session
 
-	client = create_client(
-		settings.SUPABASE_URL,
-		settings.SUPABASE_KEY,
-		options=ClientOptions(auto_refresh_token=False),
-	)
-
 	current_time = int(time.time())
 	threshold = 60 * 20  # 20 minutes before expiration
 
-	if cached_session:
-		print('found cached session')
-		if cached_session.session.expires_at > (current_time + threshold):
-			print('session is still valid')
-			return cached_session.session.access_token
-		else:
-			print('session is expired, refreshing')
-			try:
-				refreshed_session = client.auth.refresh_session()
-				cached_session = refreshed_session
-				print('session refreshed')
+	# fast path without locking, if the cached session of this user is still valid
+	session = cached_session
+	if (
+		session
+		and (session.user.email or '').lower() == user.lower()
+		and session.session.expires_at > (current_time + threshold)
+	):
+		return session.session.access_token
+
+	# only one thread refreshes or signs in, the others wait and re-check the cached session
+	with _login_lock:
+		client = _get_auth_client()
+
+		# the cached session is only valid for the user it was created for
+		if cached_session and (cached_session.user.email or '').lower() != user.lower():
+			cached_session = None
+
+		# after a restart, pick up the session of the previous process instead of signing in again
+		if not cached_session:
+			cached_session = _load_session(user)
+
+		if cached_session:
+			_logger.debug('found cached session')
+			if cached_session.session.expires_at > (current_time + threshold):
+				_logger.debug('session is still valid')
 				return cached_session.session.access_token
-			except Exception:
-				print('session refresh failed, clearing cache')
-				cached_session = None
+			else:
+				_logger.debug('session is expired, refreshing')
+				try:
+					refreshed_session = client.auth.refresh_session(cached_session.session.refresh_token)
+					cached_session = refreshed_session
+					_store_session(cached_session)
+					_logger.debug('session refreshed')
+					return cached_session.session.access_token
+				except Exception:
+					_logger.debug('session refresh failed, clearing cache')
+					cached_session = None
 
-	# If no valid cached session, perform a new login
-	try:
-		auth_response = client.auth.sign_in_with_password({'email': user, 'password': password})
-		cached_session = auth_response
-		# print('new session created and cached')
-		return cached_session.session.access_token
-	except Exception as e:
-		raise Exception(f'Login failed: {str(e)}')
+		# If no valid cached session, perform a new login
+		try:
+			auth_response = client.auth.sign_in_with_password({'email': user, 'password': password})
+			cached_session = auth_response
+			_store_session(cached_session)
+			return cached_session.session.access_token
+		except Exception as e:
+			raise Exception(f'Login failed: {str(e)}')
 
 
 def verify_token(jwt: str) -> Union[Literal[False], User]:
-	"""Verifies a user jwt token string against the active supabase sessions
+	"""Verifies a user jwt token string against the active supabase sessions.
+	Verified tokens are cached for VERIFY_CACHE_TTL seconds, but never beyond their expiry.
+	Rejected tokens are not cached, so they are checked again on the next request.
 
 	Args:
 	    jwt (str): A jwt token string
@@ -71,20 +206,88 @@ def verify_token(jwt: str) -> Union[Literal[False], User]:
 	Returns:
 	    Union[Literal[False], User]: Returns true if user session is active, false if not
 	"""
+	key = hashlib.sha256(jwt.encode()).hexdigest()
+	now = time.time()
+	with _verify_cache_lock:
+		cached = _verify_cache.get(key)
+		if cached is not None:
+			if cached[1] > now:
+				_verify_cache.move_to_end(key)
+				return cached[0]
+			del _verify_cache[key]
+
 	# make the authentication
 	with use_client(jwt) as client:
 		response = client.auth.get_user(jwt)
 
 	# check the token
 	try:
-		return response.user
+		user = response.user
 	except Exception:
 		return False
 
+	# only verified users are cached, so that a rejected token is checked again on the next request
+	if user:
+		with _verify_cache_lock:
+			_verify_cache[key] = (user, min(now + VERIFY_CACHE_TTL, _token_expires_at(jwt)))
+			_verify_cache.move_to_end(key)
+			while len(_verify_cache) > VERIFY_CACHE_SIZE:
+				_verify_cache.popitem(last=False)
+
+	return user
+
+
+def _token_expires_at(access_token: Optional[str]) -> float:
+	"""Read the expiry of a JWT without verifying it, the token itself is verified by supabase on each request"""
+	if access_token is None:
+		return float('inf')
+
+	try:
+		payload = access_token.split('.')[1]
+		claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+		return float(claims['exp'])
+	except Exception:
+		return time.time() + CLIENT_DEFAULT_TTL
+
+
+def _get_client(access_token: Optional[str]) -> Client:
+	"""Get the cached supabase client of an access token, or create it"""
+	now = time.time()
+	with _client_cache_lock:
+		cached = _client_cache.get(access_token)
+		if cached is not None and cached[1] - CLIENT_EXPIRY_MARGIN > now:
+			_client_cache.move_to_end(access_token)
+			return cached[0]
+
+	# create a supabase client
+	client = create_client(
+		settings.SUPABASE_URL,
+		settings.SUPABASE_KEY,
+		options=ClientOptions(auto_refresh_token=False),
+	)
+
+	# set the access token to the postgrest (rest-api) client if available
+	if access_token is not None:
+		client.postgrest.auth(token=access_token)
+
+	with _client_cache_lock:
+		_client_cache[access_token] = (client, _token_expires_at(access_token))
+		_client_cache.move_to_end(access_token)
+
+		# drop expired clients first, then the least recently used ones
+		for token in [t for t, (_, expires_at) in _client_cache.items() if expires_at - CLIENT_EXPIRY_MARGIN <= now]:
+			if token != access_token:
+				del _client_cache[token]
+		while len(_client_cache) > CLIENT_CACHE_SIZE:
+			_client_cache.popitem(last=False)
+
+	return client
+
 
 @contextmanager
 def use_client(access_token: Optional[str] = None) -> Generator[Client, None, None]:
-	"""Creates and returns a supabase client session
+	"""Returns a supabase client session. Clients are cached per access token until the token
+	expires, so that subsequent requests reuse their connections.
 
 	Args:
 	    access_token (Optional[str], optional): Optional access token. Defaults to None.
@@ -92,19 +295,10 @@ def use_client(access_token: Optional[str] = None) -> Generator[Client, None, No
 	Yields:
 	    Generator[Client, None, None]: A supabase client session
 	"""
-	# create a supabase client
-	client = create_client(
-		settings.SUPABASE_URL,
-		settings.SUPABASE_KEY,
-		options=ClientOptions(auto_refresh_token=False),
-	)
+	client = _get_client(access_token)
 
 	# yield the client
 	try:
-		# set the access token to the postgrest (rest-api) client if available
-		if access_token is not None:
-			client.postgrest.auth(token=access_token)
-
 		yield client
 	finally:
 		# client.auth.sign_out()
@@ -112,6 +306,40 @@ def use_client(access_token: Optional[str] = None) -> Generator[Client, None, No
 		pass
 
 
+# reads of SupabaseReader are retried on connection errors, waiting READ_RETRY_BACKOFF * 2^attempt seconds
+READ_RETRIES = 3
+READ_RETRY_BACKOFF = 0.5
+
+
+def _execute_read(query):
+	"""Execute a read query, retrying it with exponential backoff if the connection fails"""
+	for attempt in range(READ_RETRIES + 1):
+		try:
+			return query.execute()
+		except httpx.TransportError as e:
+			if attempt == READ_RETRIES:
+				raise
+			_logger.debug(f'Retrying supabase read after connection error: {e}')
+			time.sleep(READ_RETRY_BACKOFF * 2**attempt)
+
+
+@lru_cache(maxsize=None)
+def _id_field_for(Model: type[BaseModel]) -> str:
+	"""Figure out the primary field of a model once - prioritize dataset_id over id"""
+	if 'dataset_id' in Model.model_fields:
+		return 'dataset_id'
+	elif 'id' in Model.model_fields:
+		return 'id'
+	else:
+		raise AttributeError('Model does not have an id field')
+
+
+@lru_cache(maxsize=None)
+def _columns_for(Model: type[BaseModel]) -> str:
+	"""The select clause of the columns a model is built from, the models mirror their tables"""
+	return ','.join(Model.model_fields.keys())
+
+
 class SupabaseReader(BaseModel):
 	Model: type[BaseModel]
 	table: str
@@ -121,18 +349,14 @@ class SupabaseReader(BaseModel):
 		"""Reads an instance from the bound model from
 		supabase.
 		"""
-		# figure out the primary field - prioritize dataset_id over id
-		if 'dataset_id' in self.Model.model_fields:
-			id_field = 'dataset_id'
-		elif 'id' in self.Model.model_fields:
-			id_field = 'id'
-		else:
-			raise AttributeError('Model does not have an id field')
+		id_field = _id_field_for(self.Model)
 
 		with use_client(self.token) as client:
-			result = client.table(self.table).select('*').eq(id_field, dataset_id).execute()
+			result = _execute_read(
+				client.table(self.table).select(_columns_for(self.Model)).eq(id_field, dataset_id).limit(1)
+			)
 
-		if len(result.data) == 0:
+		if not result.data:
 			return None
 
-		return self.Model(**result.data[0])
+		return self.Model.model_validate(result.data[0])